@@ -7,7 +7,7 @@ import re
 import subprocess
 import time
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 from robot.libraries.BuiltIn import BuiltIn, RobotNotRunningError
 
@@ -26,6 +26,13 @@ if platform.system() == "Windows":
     import pywinauto
     import win32gui
 
+    # Resolve click handlers once instead of branching on every click
+    CLICK_TYPES = {
+        "click": pywinauto.mouse.click,
+        "double": pywinauto.mouse.double_click,
+        "right": pywinauto.mouse.right_click,
+    }
+
 
 def write_element_info_as_json(
     elements: Any, filename: str, path: str = "output/json"
@@ -57,6 +64,11 @@ class UnknownWindowsBackendError(Exception):
 
 SUPPORTED_BACKENDS = ["uia", "win32"]
 
+# Time to hold the mouse button down before moving on to the drop target
+DRAG_DROP_PRE_MOVE_DELAY = 0.05
+# Polling interval for the drag and drop readiness callback
+DRAG_DROP_POLL_INTERVAL = 0.02
+
 
 class Windows(OperatingSystem):
     """Windows methods extending OperatingSystem class."""
@@ -66,6 +78,9 @@ class Windows(OperatingSystem):
     def __init__(self, backend: str = "uia") -> None:
         OperatingSystem.__init__(self)
         self._apps = {}
+        # pywinauto applications connected by window handle, kept apart
+        # from the application details which are returned to users
+        self._handle_apps = {}
         self._app_instance_id = 0
         self._active_app_instance = -1
         self.set_windows_backend(backend)
@@ -74,6 +89,9 @@ class Windows(OperatingSystem):
         self.windowtitle = None
         self.logger = logging.getLogger(__name__)
         self.clipboard = Clipboard()
+        self._images = Images()
+        self._output_dir = None
+        self._screenshot_dirs = set()
 
     def __del__(self):
         try:
@@ -113,7 +131,6 @@ class Windows(OperatingSystem):
         dialog: bool = True,
         params: dict = None,
     ) -> int:
-        params = params or {}
         self._app_instance_id += 1
         process_id = None
         handle = None
@@ -123,7 +140,7 @@ class Windows(OperatingSystem):
                 process_id = app.process
             handle = win32gui.GetForegroundWindow()
 
-        default_params = {
+        app_instance = {
             "app": app,
             "id": self._app_instance_id,
             "dialog": dialog,
@@ -131,8 +148,10 @@ class Windows(OperatingSystem):
             "handle": handle,
             "dispatched": False,
         }
+        if params:
+            app_instance.update(params)
 
-        self._apps[self._app_instance_id] = {**default_params, **params}
+        self._apps[self._app_instance_id] = app_instance
 
         self.logger.debug(
             "Added app instance %s: %s",
@@ -157,7 +176,7 @@ class Windows(OperatingSystem):
             Switch To Application   ${app1}
 
         """
-        if app_id and app_id in self._apps.keys():
+        if app_id and app_id in self._apps:
             app = self.get_app(app_id)
             self._active_app_instance = app_id
             self.app = app["app"]
@@ -320,7 +339,9 @@ class Windows(OperatingSystem):
         self.send_keys("{VK_LWIN down}r{VK_LWIN up}")
         delay(1)
 
-        self.send_keys_to_input(executable, send_delay=0.2, enter_delay=0.5)
+        self.send_keys_to_input(
+            executable, send_delay=0.2, enter_delay=0.5, key_pause=0
+        )
 
         app_instance = self.open_dialog(windowtitle)
         self._apps[app_instance]["windowtitle"] = windowtitle
@@ -347,7 +368,7 @@ class Windows(OperatingSystem):
         self.send_keys("{LWIN}")
         delay(1)
 
-        self.send_keys_to_input(executable)
+        self.send_keys_to_input(executable, key_pause=0)
 
         app_instance = self.open_dialog(windowtitle)
         self._apps[app_instance]["windowtitle"] = windowtitle
@@ -377,6 +398,7 @@ class Windows(OperatingSystem):
         with_enter: bool = True,
         send_delay: float = 0.5,
         enter_delay: float = 1.5,
+        key_pause: float = None,
     ) -> None:
         """Send keys to windows and add ENTER if `with_enter` is True
 
@@ -387,6 +409,7 @@ class Windows(OperatingSystem):
         :param with_enter: send ENTER if `with_enter` is True
         :param send_delay: delay after send_keys
         :param enter_delay: delay after ENTER
+        :param key_pause: delay between each key press, see `Send Keys`
 
         Example:
 
@@ -402,7 +425,7 @@ class Windows(OperatingSystem):
         if platform.system() == "Windows":
             win32api.LoadKeyboardLayout("00000409", 1)
 
-        self.send_keys(keys_to_type)
+        self.send_keys(keys_to_type, pause=key_pause)
         delay(send_delay)
         if with_enter:
             self.send_keys("{ENTER}")
@@ -453,17 +476,20 @@ class Windows(OperatingSystem):
             windowtitle or self._apps[self._active_app_instance]["windowtitle"]
         )
         self.logger.info("Restore dialog: %s", windowtitle)
-        app = pywinauto.Application().connect(title_re=".*%s" % windowtitle)
         try:
+            app = pywinauto.Application().connect(title_re=".*%s" % windowtitle)
             app.window().restore()
+            return
         except pywinauto.findwindows.ElementAmbiguousError as e:
             self.logger.info("Could not restore dialog, %s", str(e))
-        finally:
-            if "handle" in self._apps[self._active_app_instance]:
-                app = pywinauto.Application().connect(
-                    handle=self._apps[self._active_app_instance]["handle"]
-                )
-                app.window().restore()
+
+        # Fall back to the window handle of the active application
+        handle = self._apps[self._active_app_instance].get("handle")
+        if handle is None:
+            return
+        if handle not in self._handle_apps:
+            self._handle_apps[handle] = pywinauto.Application().connect(handle=handle)
+        self._handle_apps[handle].window().restore()
 
     def open_dialog(
         self,
@@ -608,6 +634,7 @@ class Windows(OperatingSystem):
                     self.kill_process_by_pid(app["process"])
                 else:
                     app["app"].kill()
+        self._handle_apps.pop(app.get("handle"), None)
         self._active_app_instance = -1
 
     def type_keys(self, keys: str) -> None:
@@ -652,10 +679,12 @@ class Windows(OperatingSystem):
         else:
             raise ValueError(f"Could not find unique element for '{locator}'")
 
-    def send_keys(self, keys: str) -> None:
+    def send_keys(self, keys: str, pause: float = None) -> None:
         """Send keys into active windows.
 
         :param keys: list of keys to send
+        :param pause: delay in seconds between each key press, default `None`
+         means using pywinauto default value
 
         Example:
 
@@ -666,7 +695,10 @@ class Windows(OperatingSystem):
 
         """
         self.logger.info("Send keys: %s", keys)
-        pywinauto.keyboard.send_keys(keys)
+        if pause is None:
+            pywinauto.keyboard.send_keys(keys)
+        else:
+            pywinauto.keyboard.send_keys(keys, pause=float(pause))
 
     def get_text(self, locator: str) -> dict:
         """Get text from element
@@ -790,7 +822,7 @@ class Windows(OperatingSystem):
             Mouse Click  image=myimage.png  tolerance=0.8
 
         """
-        matches = Images().find_template_on_screen(template, limit=1, **kwargs)
+        matches = self._images.find_template_on_screen(template, limit=1, **kwargs)
 
         center_x = matches[0].center.x + int(off_x)
         center_y = matches[0].center.y + int(off_y)
@@ -1228,12 +1260,9 @@ class Windows(OperatingSystem):
         self.logger.info("Click type '%s' at (%s, %s)", click_type, x, y)
         if (x is None and y is None) or (x < 0 or y < 0):
             raise ValueError(f"Can't click on given coordinates: ({x}, {y})")
-        if click_type == "click":
-            pywinauto.mouse.click(coords=(x, y))
-        elif click_type == "double":
-            pywinauto.mouse.double_click(coords=(x, y))
-        elif click_type == "right":
-            pywinauto.mouse.right_click(coords=(x, y))
+        click = CLICK_TYPES.get(click_type)
+        if click is not None:
+            click(coords=(x, y))
 
     def get_window_elements(
         self,
@@ -1373,17 +1402,31 @@ class Windows(OperatingSystem):
                     "Unable to take screenshot, because regions was: %s", region
                 )
                 return
-        try:
-            output_dir = BuiltIn().get_variable_value("${OUTPUT_DIR}")
-        except (ModuleNotFoundError, RobotNotRunningError):
-            output_dir = Path.cwd()
 
-        filename = Path(output_dir, "images", clean_filename(filename))
-        os.makedirs(filename.parent, exist_ok=overwrite)
-        Images().take_screenshot(filename=filename, region=region)
+        filename = self._get_screenshot_path(filename, overwrite)
+        self._images.take_screenshot(filename=filename, region=region)
 
         self.logger.info("Saved screenshot as '%s'", filename)
 
+    def _get_screenshot_path(self, filename: str, overwrite: bool) -> Path:
+        path = Path(self._get_output_dir(), "images", clean_filename(filename))
+        if path.parent not in self._screenshot_dirs:
+            os.makedirs(path.parent, exist_ok=True)
+            self._screenshot_dirs.add(path.parent)
+        # Screenshots are always saved as PNG files
+        if not overwrite and path.with_suffix(".png").exists():
+            raise FileExistsError(f"Screenshot already exists: {path}")
+        return path
+
+    def _get_output_dir(self) -> Any:
+        if self._output_dir is None:
+            try:
+                self._output_dir = BuiltIn().get_variable_value("${OUTPUT_DIR}")
+            except (ModuleNotFoundError, RobotNotRunningError):
+                # Not cached, as the working directory may still change
+                return Path.cwd()
+        return self._output_dir
+
     def _parse_element_attributes(self, element: dict) -> dict:
         """Return filtered element dictionary for an element.
 
@@ -1560,6 +1603,7 @@ class Windows(OperatingSystem):
         target_locator: str = None,
         handle_ctrl_key: bool = False,
         drop_delay: float = 2.0,
+        wait_for_ready: Callable[[], bool] = None,
     ) -> None:
         # pylint: disable=C0301
         """Drag elements from source and drop them on target.
@@ -1575,6 +1619,9 @@ class Windows(OperatingSystem):
         :param handle_ctrl_key: True if keyword should press CTRL down dragging
         :param drop_delay: how many seconds to wait until releasing mouse drop,
          default 2.0
+        :param wait_for_ready: optional callable which returns True when the
+         target is ready for the drop, if given the drop happens as soon as it
+         returns True or at the latest after `drop_delay`
         :raises ValueError: on validation errors
 
         Example:
@@ -1621,17 +1668,16 @@ class Windows(OperatingSystem):
                 # pywinauto.mouse.click(coords=(selection[0]+5, selection[1]+5))
                 self.mouse_click_coords(selection[0] + 5, selection[1] + 5)
 
-            # Start drag from the last item
+            # Start drag from the last item, the button is held down
+            # until it is released over the target
             pywinauto.mouse.press(coords=(source_x, source_y))
-            delay(0.5)
+            delay(DRAG_DROP_PRE_MOVE_DELAY)
             if not single_application:
                 self.restore_dialog(target["windowtitle"])
             pywinauto.mouse.move(coords=(target_x, target_y))
 
             self.logger.debug("Cursor position: %s", win32api.GetCursorPos())
-            delay(drop_delay)
-            self.mouse_click_coords(target_x, target_y)
-            pywinauto.mouse.click(coords=(target_x, target_y))
+            self._drop(target_x, target_y, drop_delay, wait_for_ready)
 
             # if action_required:
             self.send_keys("{ENTER}")
@@ -1645,6 +1691,33 @@ class Windows(OperatingSystem):
         finally:
             self.send_keys("{VK_LCONTROL up}")
 
+    def _drop(
+        self,
+        x: int,
+        y: int,
+        drop_delay: float,
+        wait_for_ready: Callable[[], bool] = None,
+    ) -> None:
+        try:
+            self._wait_for_drop(drop_delay, wait_for_ready)
+        finally:
+            # Don't leave the button held down if the readiness check fails
+            pywinauto.mouse.release(coords=(x, y))
+
+    def _wait_for_drop(
+        self, drop_delay: float, wait_for_ready: Callable[[], bool] = None
+    ) -> None:
+        if wait_for_ready is None:
+            delay(drop_delay)
+            return
+
+        end_time = time.monotonic() + float(drop_delay)
+        while not wait_for_ready():
+            if time.monotonic() >= end_time:
+                self.logger.debug("Target not ready for drop within %s s", drop_delay)
+                break
+            time.sleep(DRAG_DROP_POLL_INTERVAL)
+
     def calculate_rectangle_center(self, rectangle: Any) -> Any:
         """Calculate x and y center coordinates from rectangle.
 
@@ -1,11 +1,25 @@
+import functools
 import logging
-from urllib.parse import urlparse
-from typing import Any
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+from typing import Any, Tuple
 
 from RequestsLibrary import RequestsLibrary
 from RPA.FileSystem import FileSystem
 from RPA.core.notebook import notebook_file
 
+# Size of chunks written to disk when downloading to a file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@functools.lru_cache(maxsize=256)
+def _split_url(url: str) -> Tuple[str, str, str]:
+    """Split URL into host, session key, and the path relative to host."""
+    uc = urlsplit(url)
+    http_host = f"{uc.scheme}://{uc.netloc}"
+    url_path = urlunsplit(("", "", uc.path, uc.query, uc.fragment))
+    return http_host, f"{uc.scheme}{uc.netloc}", url_path
+
 
 class HTTP(RequestsLibrary):
     """RPA Framework HTTP library that extends functionality of RequestsLibrary,
@@ -28,6 +42,7 @@ class HTTP(RequestsLibrary):
         verify: bool = True,
         force_new_session: bool = False,
         overwrite: bool = False,
+        stream: bool = False,
     ) -> dict:
         """
         A helper method for ``Get Request`` that will create a session, perform GET
@@ -49,27 +64,63 @@ class HTTP(RequestsLibrary):
         ``overwrite`` used together with ``target_file``, if ``True`` will overwrite
         the target file, default ``False``
 
+        ``stream`` used together with binary ``target_file``, if ``True`` the
+        content is written to the file in chunks instead of loading it into
+        memory first, default ``False``. The content of a streamed response
+        can not be read afterwards.
+
         Returns request response.
         """
-        uc = urlparse(url)
-
-        http_host = f"{uc.scheme}://{uc.netloc}"
-        request_alias = f"{self.session_alias_prefix}{uc.scheme}{uc.netloc}"
-        url_path = url.replace(http_host, "")
+        http_host, session_key, url_path = _split_url(url)
+        request_alias = self.session_alias_prefix + session_key
         if force_new_session or not self.session_exists(request_alias):
             self.logger.info("Creating a new HTTP session")
             self.create_session(request_alias, http_host, verify=verify)
         else:
             self.logger.info("Using already existing HTTP session")
         self.current_session_alias = request_alias
-        response = self.get_request(request_alias, url_path)
-        if target_file is not None:
-            self._create_or_overwrite_target_file(
-                target_file, response.content, binary, overwrite
+        if stream and target_file is not None and binary:
+            response = self._download_to_file(
+                request_alias, url, target_file, overwrite
             )
+        else:
+            response = self.get_request(request_alias, url_path)
+            if target_file is not None:
+                self._create_or_overwrite_target_file(
+                    target_file, response.content, binary, overwrite
+                )
+        if target_file is not None:
             notebook_file(target_file)
         return response
 
+    def _download_to_file(
+        self, alias: str, url: str, target_file: str, overwrite: bool
+    ) -> Any:
+        if not overwrite and Path(target_file).exists():
+            raise FileExistsError(f"Path already exists: {target_file}")
+
+        # Use the session directly, as RequestsLibrary would read
+        # the whole response body into memory when logging it
+        session = self._cache.switch(alias)
+        response = session.get(
+            url,
+            stream=True,
+            timeout=self.timeout,
+            cookies=self.cookies,
+            verify=self.verify,
+        )
+        session.last_resp = response
+        self.logger.info(
+            "GET Response: status=%s, reason=%s",
+            response.status_code,
+            response.reason,
+        )
+
+        with response, open(target_file, "wb") as fd:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                fd.write(chunk)
+        return response
+
     def _create_or_overwrite_target_file(
         self,
         target_file: str,
@@ -97,6 +148,7 @@ class HTTP(RequestsLibrary):
         verify: bool = True,
         force_new_session: bool = False,
         overwrite: bool = False,
+        stream: bool = False,
     ) -> dict:
         """An alias for the ``HTTP Get`` keyword.
 
@@ -117,18 +169,16 @@ class HTTP(RequestsLibrary):
 
         ``overwrite`` used together with ``target_file``, if ``True`` will overwrite
         the target file, default ``False``
+
+        ``stream`` if ``True`` the binary content is written to the file in
+        chunks instead of loading it into memory first, default ``False``.
+        The content of a streamed response can not be read afterwards.
         """
-        response = self.http_get(
-            url, target_file, binary, verify, force_new_session, overwrite
-        )
         if target_file is None:
-            uc = urlparse(url)
-            target = uc.path.rsplit("/", 1)[-1]
-            if not target:
-                target = "downloaded.html"
+            url_path = _split_url(url)[2]
+            filename = url_path.partition("?")[0].partition("#")[0]
+            target_file = filename.rsplit("/", 1)[-1] or "downloaded.html"
 
-            self._create_or_overwrite_target_file(
-                target, response.content, binary, overwrite
-            )
-            notebook_file(target)
-        return response
+        return self.http_get(
+            url, target_file, binary, verify, force_new_session, overwrite, stream
+        )
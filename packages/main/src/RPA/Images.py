@@ -1,6 +1,10 @@
+import functools
 import logging
+import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, astuple
 from pathlib import Path
 
@@ -32,6 +36,23 @@ except ImportError:
     HAS_OPENCV = False
 
 
+def _opencv_threads():
+    """Number of threads used by OpenCV, overridable with RPA_CV_THREADS."""
+    default = max(1, (os.cpu_count() or 2) // 2)
+    try:
+        return int(os.environ.get("RPA_CV_THREADS", default))
+    except ValueError:
+        return default
+
+
+if HAS_OPENCV:
+    # Containers often default to a single thread or oversubscribe,
+    # so make the optimized code paths and thread count explicit
+    # pylint: disable=no-member
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(_opencv_threads())
+
+
 def clamp(minimum, value, maximum):
     """Clamp value between given minimum and maximum."""
     return max(minimum, min(value, maximum))
@@ -46,7 +67,46 @@ def to_image(obj):
     """Convert `obj` to instance of Pillow's Image class."""
     if obj is None or isinstance(obj, Image.Image):
         return obj
-    return Image.open(obj)
+
+    # Read the pixel data right away, which also closes the file handle
+    image = Image.open(obj)
+    image.load()
+    return image
+
+
+def to_template(obj):
+    """Convert `obj` to instance of Pillow's Image class, with alpha channel
+    stripped. Templates read from files are cached until the file changes.
+    """
+    if isinstance(obj, (str, Path)):
+        path = os.path.abspath(obj)
+        return _load_template(path, os.stat(path).st_mtime_ns)
+
+    template = to_image(obj)
+    if template is not None and template.mode == "RGBA":
+        template = template.convert("RGB")
+    return template
+
+
+@functools.lru_cache(maxsize=32)
+def _load_template(path, mtime):  # pylint: disable=unused-argument
+    template = Image.open(path)
+    template.load()
+    if template.mode == "RGBA":
+        template = template.convert("RGB")
+    return template
+
+
+def is_array(obj):
+    """Check if `obj` is a numpy array."""
+    return HAS_OPENCV and isinstance(obj, numpy.ndarray)
+
+
+def get_size(image):
+    """Get width and height of Pillow image or numpy array."""
+    if is_array(image):
+        return image.shape[1], image.shape[0]
+    return image.size
 
 
 def to_point(obj):
@@ -130,6 +190,8 @@ class Region:
 class RGB:
     """Container for a single RGB value."""
 
+    __slots__ = ("red", "green", "blue")
+
     red: int
     green: int
     blue: int
@@ -147,14 +209,158 @@ class RGB:
         return cls(red, green, blue)
 
     def luminance(self):
-        """Approximate (perceived) luminance for RGB value."""
-        return (self.red * 2 + self.green * 3 + self.blue) // 6
+        """Perceived luminance for RGB value, using ITU-R BT.601 weights."""
+        return (self.red * 299 + self.green * 587 + self.blue * 114) // 1000
+
+
+def to_grayscale(array):
+    """Convert RGB `array` to single channel, if it isn't already."""
+    # pylint: disable=no-member
+    if array.ndim == 3:
+        return cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+    return array
+
+
+def build_pyramid(array, levels):
+    """Create a Gaussian pyramid of `array`, starting from the original."""
+    # pylint: disable=no-member
+    arrays = [array]
+    for _ in range(levels):
+        arrays.append(cv2.pyrDown(arrays[-1]))
+    return arrays
+
+
+def find_peaks(coefficients, tolerance, half_width, half_height, limit=-1):
+    """Find coordinates of separate peaks in a template matching result.
+
+    :param coefficients:    correlation coefficient map
+    :param tolerance:       minimum coefficient for a peak
+    :param half_width:      horizontal suppression distance
+    :param half_height:     vertical suppression distance
+    :param limit:           maximum number of peaks, negative for no limit
+    :return:                row and column coordinates of peaks, best first
+    """
+    # Collect all candidates in one pass and order them by score,
+    # ties are kept in row-major order like with cv2.minMaxLoc()
+    ys, xs = numpy.nonzero(coefficients >= tolerance)
+    order = numpy.argsort(-coefficients[ys, xs], kind="stable")
+    ys, xs = ys[order], xs[order]
+
+    height, width = coefficients.shape
+    peaks = _suppress_peaks(ys, xs, height, width, half_width, half_height, limit)
+    return ys[peaks], xs[peaks]
+
+
+# Minimum number of candidates for compiling peak suppression with numba
+NUMBA_MIN_CANDIDATES = 10000
+
+
+def _suppress_peaks(ys, xs, height, width, half_width, half_height, limit):
+    args = (ys, xs, height, width, half_width, half_height, limit)
+    if len(ys) >= NUMBA_MIN_CANDIDATES:
+        compiled = _compile_suppress_peaks()
+        if compiled is not None:
+            return compiled(*args)
+    return _suppress_peaks_loop(*args)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_suppress_peaks():
+    """Compile the suppression loop with numba, if available. Done lazily,
+    as importing numba and compiling take much longer than the loop itself
+    for the few candidates of a typical search.
+    """
+    try:
+        import numba  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return numba.njit(_suppress_peaks_loop)
+
+
+def _suppress_peaks_loop(ys, xs, height, width, half_width, half_height, limit):
+    # Kept free of Python objects so that it can be compiled with numba
+    suppressed = numpy.zeros((height, width), dtype=numpy.bool_)
+    peaks = numpy.empty(len(ys), dtype=numpy.int64)
+    count = 0
+    for idx, y in enumerate(ys):
+        x = xs[idx]
+        if suppressed[y, x]:
+            continue
+
+        peaks[count] = idx
+        count += 1
+        if 0 <= limit <= count:
+            break
+
+        suppressed[
+            max(y - half_height, 0) : y + half_height,
+            max(x - half_width, 0) : x + half_width,
+        ] = True
+
+    return peaks[:count]
 
 
 class ImageNotFoundError(Exception):
     """Raised when template matching fails."""
 
 
+class CaptureStream:
+    """Background thread which keeps capturing the whole desktop,
+    so that the latest frame is always available without waiting for
+    a new screen grab.
+    """
+
+    def __init__(self, fps=10):
+        self.interval = 1.0 / float(fps)
+        self._frame = None
+        self._error = None
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._frame = None
+
+    def latest(self):
+        """Latest captured mss screenshot, waits for the first frame."""
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self._frame
+
+    def _run(self):
+        try:
+            # mss instances can not be shared between threads,
+            # so the capture context is owned by this thread
+            with mss.mss() as sct:
+                monitor = sct.monitors[0]
+                while not self._stopped.is_set():
+                    self._frame = sct.grab(monitor)
+                    self._ready.set()
+                    self._stopped.wait(self.interval)
+        except Exception as err:  # pylint: disable=broad-except
+            self._error = err
+        finally:
+            self._ready.set()
+
+
 class Images:
     """Library for taking screenshots, matching templates, and
     manipulating images.
@@ -163,6 +369,39 @@ class Images:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.matcher = TemplateMatcher(opencv=HAS_OPENCV)
+        self._stream = None
+        self._screenshot_buf = None
+
+    def __del__(self):
+        self.stop_capture_stream()
+
+    def start_capture_stream(self, fps=10):
+        """Start capturing the desktop continuously in the background.
+
+        While the stream is running, screenshots of the whole desktop
+        are served from the most recent captured frame, which makes
+        polling the screen considerably cheaper.
+
+        :param fps: Number of frames captured per second
+        """
+        self.stop_capture_stream()
+        self._stream = CaptureStream(fps)
+        self._stream.start()
+
+    def stop_capture_stream(self):
+        """Stop a capture stream started with ``start_capture_stream()``."""
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream = None
+
+    def get_latest_frame(self):
+        """Get the latest desktop frame from the capture stream.
+
+        :raises RuntimeError: Capture stream is not running
+        """
+        if self._stream is None:
+            raise RuntimeError("Capture stream is not running")
+        return self.take_screenshot()
 
     def take_screenshot(self, filename=None, region=None) -> Image:
         """Take a screenshot of the current desktop.
@@ -172,14 +411,7 @@ class Images:
         """
 
         region = to_region(region)
-
-        with mss.mss() as sct:
-            if region is not None:
-                image = sct.grab(region.as_tuple())
-            else:
-                # mss uses the first monitor on the array as an
-                # alias for a combined virtual monitor
-                image = sct.grab(sct.monitors[0])
+        image = self._grab(region)
 
         if filename is not None:
             filename = Path(filename).with_suffix(".png")
@@ -191,59 +423,110 @@ class Images:
         pillow_image = Image.frombytes("RGB", image.size, image.bgra, "raw", "BGRX")
         return pillow_image
 
+    def _grab(self, region=None):
+        """Capture raw mss screenshot of the desktop or given region."""
+        if region is None and self._stream is not None:
+            return self._stream.latest()
+
+        with mss.mss() as sct:
+            if region is not None:
+                return sct.grab(region.as_tuple())
+            # mss uses the first monitor on the array as an
+            # alias for a combined virtual monitor
+            return sct.grab(sct.monitors[0])
+
+    def _take_search_screenshot(self):
+        """Capture the desktop for template matching. With OpenCV the raw
+        capture is converted directly to an RGB array, which skips
+        creating a Pillow image and copying it again to an array.
+
+        The array is written into a buffer that is reused between calls,
+        so the returned value is only valid until the next capture.
+        """
+        if not HAS_OPENCV:
+            return self.take_screenshot()
+
+        raw = numpy.asarray(self._grab())
+        shape = (raw.shape[0], raw.shape[1], 3)
+        if self._screenshot_buf is None or self._screenshot_buf.shape != shape:
+            self._screenshot_buf = numpy.empty(shape, dtype=numpy.uint8)
+
+        # pylint: disable=no-member
+        return cv2.cvtColor(raw, cv2.COLOR_BGRA2RGB, dst=self._screenshot_buf)
+
     def crop_image(self, image, region, filename=None):
         """Crop an existing image.
 
         :param image:       Image to crop
         :param region:      Region to crop image to
         :param filename:    Save cropped image to filename
+        :return:            Cropped image
         """
         region = to_region(region)
         image = to_image(image)
 
         image = image.crop(region.as_tuple())
-        image.load()
 
         if filename:
             # Suffix isn't created automatically here
             image.save(Path(filename).with_suffix(".png"), "PNG")
             notebook_image(filename)
 
+        return image
+
     def find_template_in_image(
-        self, image, template, region=None, limit=None, tolerance=None
+        self,
+        image,
+        template,
+        region=None,
+        limit=None,
+        tolerance=None,
+        grayscale=True,
+        pyramid=False,
     ):
         """Attempt to find the template from the given image.
 
-        :param image:       Path to image or Image instance, used to search from
+        :param image:       Path to image, Image instance or RGB array,
+                            used to search from
         :param template:    Path to image or Image instance, used to search with
         :param limit:       Limit returned results to maximum of `limit`.
         :param region:      Area to search from. Can speed up search significantly.
         :param tolerance:   Tolerance for matching, value between 0.1 and 1.0
+        :param grayscale:   Match in grayscale, faster but ignores differences
+                            in color alone
+        :param pyramid:     Search large images coarse-to-fine, can be faster
+                            but may miss the best match in images with many
+                            similar areas
         :return:            List of matching regions
         :raises ImageNotFoundError: No match was found
         """
-        # Ensure images are in Pillow format
-        image = to_image(image)
-        template = to_image(template)
+        # Ensure images are in Pillow format, unless already an array
+        if not is_array(image):
+            image = to_image(image)
+        template = to_template(template)
 
         # Crop image if requested
         if region is not None:
             region = to_region(region)
-            image = image.crop(region.as_tuple())
+            if is_array(image):
+                image = image[region.top : region.bottom, region.left : region.right]
+            else:
+                image = image.crop(region.as_tuple())
 
         # Verify template still fits in image
-        if template.size[0] > image.size[0] or template.size[1] > image.size[1]:
+        image_size = get_size(image)
+        if template.size[0] > image_size[0] or template.size[1] > image_size[1]:
             raise ValueError("Template is larger than search region")
 
-        # Strip alpha channels
-        if image.mode == "RGBA":
+        # Strip alpha channel, already done for template
+        if not is_array(image) and image.mode == "RGBA":
             image = image.convert("RGB")
-        if template.mode == "RGBA":
-            template = template.convert("RGB")
 
         # Do the actual search
         start = time.time()
-        matches = self.matcher.match(image, template, limit, tolerance)
+        matches = self.matcher.match(
+            image, template, limit, tolerance, grayscale, pyramid
+        )
         logging.info("Scanned image in %.2f seconds", time.time() - start)
 
         if not matches:
@@ -260,7 +543,39 @@ class Images:
         """Attempt to find the template image from the current desktop.
         For argument descriptions, see ``find_template_in_image()``
         """
-        return self.find_template_in_image(self.take_screenshot(), template, **kwargs)
+        return self.find_template_in_image(
+            self._take_search_screenshot(), template, **kwargs
+        )
+
+    def find_templates_on_screen(self, templates, **kwargs):
+        """Attempt to find multiple template images from the current desktop.
+        The desktop is captured only once, and the templates are searched
+        from it in parallel. For argument descriptions,
+        see ``find_template_in_image()``
+
+        :param templates:   List of paths to images or Image instances
+        :return:            List of matching regions for each template,
+                            empty for templates that were not found
+        """
+        templates = list(templates)
+        if not templates:
+            return []
+
+        screenshot = self._take_search_screenshot()
+        # Convert the shared screenshot once, instead of for every template
+        if self.matcher.opencv and kwargs.get("grayscale", True):
+            screenshot = to_grayscale(screenshot)
+
+        def find(template):
+            try:
+                return self.find_template_in_image(screenshot, template, **kwargs)
+            except ImageNotFoundError:
+                return []
+
+        # OpenCV releases the GIL while matching, so threads run in parallel
+        workers = min(len(templates), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(find, templates))
 
     def wait_template_on_screen(self, template, timeout=5, **kwargs):
         """Wait for template image to appear on current desktop.
@@ -268,12 +583,15 @@ class Images:
 
         :param timeout: Time to wait for template (in seconds)
         """
-        start_time = time.time()
-        while time.time() - start_time > timeout:
+        # Decode template only once instead of on every poll
+        template = to_template(template)
+
+        deadline = time.monotonic() + float(timeout)
+        while time.monotonic() < deadline:
             try:
                 return self.find_template_on_screen(template, **kwargs)
             except ImageNotFoundError:
-                time.sleep(0.1)
+                time.sleep(max(0, min(0.1, deadline - time.monotonic())))
         raise ImageNotFoundError("Couldn't find template on screen within timeout")
 
     def show_region_in_image(self, image, region, color="red", width=5):
@@ -324,12 +642,30 @@ class TemplateMatcher:
 
     DEFAULT_TOLERANCE = 0.95  # Tolerance for correlation matching methods
 
+    # Search images larger than this (in pixels) with an image pyramid,
+    # when requested
+    PYRAMID_MIN_AREA = 1000000
+    # Maximum number of times images are halved for the coarsest search
+    PYRAMID_MAX_LEVELS = 2
+    # Minimum template width or height on the coarsest level
+    PYRAMID_MIN_SIZE = 16
+    # How much tolerance is loosened for candidates per pyramid level
+    PYRAMID_TOLERANCE_MARGIN = 0.15
+    # Distance in pixels around candidates to refine on the next level
+    PYRAMID_SEARCH_RADIUS = 3
+    # Search the full image directly if a level has more candidates than this
+    PYRAMID_MAX_CANDIDATES = 1000
+
     def __init__(self, opencv=False):
         self.logger = logging.getLogger(__name__)
         self._opencv = opencv
         self._tolerance = self.DEFAULT_TOLERANCE
         self._tolerance_warned = False
 
+    @property
+    def opencv(self):
+        return self._opencv
+
     @property
     def tolerance(self):
         return self._tolerance
@@ -338,29 +674,47 @@ class TemplateMatcher:
     def tolerance(self, value):
         self._tolerance = clamp(0.10, value, 1.00)
 
-    def match(self, image, template, limit=None, tolerance=None):
+    def match(
+        self,
+        image,
+        template,
+        limit=None,
+        tolerance=None,
+        grayscale=True,
+        pyramid=False,
+    ):
         """Attempt to find the template in the given image.
 
         :param image:       image to search from
         :param template:    image to search with
         :param limit:       maximum number of returned matches
         :param tolerance:   minimum correlation factor between template and image
+        :param grayscale:   match grayscale versions of the images,
+                            always done with the pillow method
+        :param pyramid:     search large images coarse-to-fine,
+                            only supported with the opencv method
         :return:            list of regions that match criteria
         """
         if self._opencv:
-            match_func = self._iter_match_opencv
+            match_iter = self._iter_match_opencv(
+                image, template, tolerance, limit, grayscale, pyramid
+            )
         else:
-            match_func = self._iter_match_pillow
+            if is_array(image):
+                image = Image.fromarray(image)
+            match_iter = self._iter_match_pillow(image, template, tolerance)
 
         matches = []
-        for match in match_func(image, template, tolerance):
+        for match in match_iter:
             matches.append(match)
             if limit is not None and len(matches) >= int(limit):
                 break
 
         return matches
 
-    def _iter_match_opencv(self, image, template, tolerance):
+    def _iter_match_opencv(
+        self, image, template, tolerance, limit=None, grayscale=True, pyramid=False
+    ):
         """Use opencv's matchTemplate() to slide the `template` over
         `image` to calculate correlation coefficients, and then
         filter with a tolerance to find all relevant global maximums.
@@ -369,25 +723,102 @@ class TemplateMatcher:
         tolerance = tolerance or self.tolerance
         template_width, template_height = template.size
 
-        image = numpy.array(image)
-        template = numpy.array(template)
-
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        template = cv2.cvtColor(template, cv2.COLOR_RGB2BGR)
+        # Channel order does not affect correlation, as long as it's the
+        # same for both images, so there's no need to convert to BGR
+        image = numpy.asarray(image)
+        template = numpy.asarray(template)
+
+        # Single channel images are a third of the data to correlate
+        if grayscale:
+            image = to_grayscale(image)
+            template = to_grayscale(template)
+
+        coefficients = None
+        levels = self._pyramid_levels(image, template) if pyramid else 0
+        if levels:
+            coefficients = self._match_pyramid(image, template, tolerance, levels)
+        if coefficients is None:
+            coefficients = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+
+        ys, xs = find_peaks(
+            coefficients,
+            tolerance,
+            max(template_width // 2, 1),
+            max(template_height // 2, 1),
+            int(limit) if limit is not None else -1,
+        )
 
-        coefficients = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+        for y, x in zip(ys, xs):
+            yield Region.from_size(int(x), int(y), template_width, template_height)
 
-        while True:
-            _, match_coeff, _, (match_x, match_y) = cv2.minMaxLoc(coefficients)
-            if match_coeff < tolerance:
-                break
+    def _pyramid_levels(self, image, template):
+        """Number of pyramid levels worth building for the given images,
+        zero if the image should be searched directly.
+        """
+        if image.shape[0] * image.shape[1] < self.PYRAMID_MIN_AREA:
+            return 0
+
+        levels = 0
+        size = min(template.shape[:2])
+        while levels < self.PYRAMID_MAX_LEVELS and size // 2 >= self.PYRAMID_MIN_SIZE:
+            size //= 2
+            levels += 1
+
+        return levels
+
+    def _match_pyramid(self, image, template, tolerance, levels):
+        """Coarse-to-fine search, where the whole image is searched only
+        on the smallest pyramid level. On every larger level only
+        the surroundings of the previous level's peaks are searched.
+
+        Returns a full-size coefficient map, where positions that
+        were not searched are set to -1, or None if the image should be
+        searched directly instead. That happens when a level has no candidates
+        or too many of them, or when no match is found on the full size level.
+        """
+        # pylint: disable=no-member
+        images = build_pyramid(image, levels)
+        templates = build_pyramid(template, levels)
+        radius = self.PYRAMID_SEARCH_RADIUS
 
-            coefficients[
-                match_y - template_height // 2 : match_y + template_height // 2,
-                match_x - template_width // 2 : match_x + template_width // 2,
-            ] = 0
+        coefficients = cv2.matchTemplate(
+            images[-1], templates[-1], cv2.TM_CCOEFF_NORMED
+        )
 
-            yield Region.from_size(match_x, match_y, template_width, template_height)
+        for level in reversed(range(levels)):
+            # Details get blurred on every level, which lowers correlation
+            coarse_tolerance = tolerance - self.PYRAMID_TOLERANCE_MARGIN * (level + 1)
+            # Refine every candidate, as suppressing neighbours on a blurred
+            # level can discard the position of the real peak
+            ys, xs = numpy.nonzero(coefficients >= max(coarse_tolerance, 0.0))
+            if not 0 < len(ys) <= self.PYRAMID_MAX_CANDIDATES:
+                return None
+
+            template_height, template_width = templates[level].shape[:2]
+            level_image = images[level]
+            rows = level_image.shape[0] - template_height + 1
+            cols = level_image.shape[1] - template_width + 1
+            coefficients = numpy.full((rows, cols), -1.0, dtype=numpy.float32)
+
+            for y, x in zip(ys, xs):
+                top = clamp(0, 2 * y - radius, rows - 1)
+                bottom = clamp(top + 1, 2 * y + radius + 1, rows)
+                left = clamp(0, 2 * x - radius, cols - 1)
+                right = clamp(left + 1, 2 * x + radius + 1, cols)
+
+                roi = level_image[
+                    top : bottom + template_height - 1,
+                    left : right + template_width - 1,
+                ]
+                coefficients[top:bottom, left:right] = cv2.matchTemplate(
+                    roi, templates[level], cv2.TM_CCOEFF_NORMED
+                )
+
+        # Candidates might have led to the wrong areas on blurred levels
+        if not (coefficients >= tolerance).any():
+            return None
+
+        return coefficients
 
     def _iter_match_pillow(self, image, template, tolerance):
         """Brute-force search for template image in larger image.
@@ -0,0 +1,61 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from RPA.HTTP import HTTP, DOWNLOAD_CHUNK_SIZE
+
+# Content spanning multiple download chunks
+CONTENT = bytes(range(256)) * (DOWNLOAD_CHUNK_SIZE // 128 + 3)
+
+
+class ContentHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(CONTENT)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), ContentHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_keeps_content(server, tmp_path):
+    target = tmp_path / "blob.bin"
+
+    response = HTTP().download(f"{server}/blob.bin", str(target))
+
+    assert target.read_bytes() == CONTENT
+    assert response.content == CONTENT
+
+
+def test_download_stream(server, tmp_path):
+    target = tmp_path / "blob.bin"
+
+    response = HTTP().download(f"{server}/blob.bin", str(target), stream=True)
+
+    assert response.status_code == 200
+    assert target.read_bytes() == CONTENT
+
+
+def test_download_stream_overwrite(server, tmp_path):
+    library = HTTP()
+    target = tmp_path / "blob.bin"
+    target.write_bytes(b"existing")
+
+    with pytest.raises(FileExistsError):
+        library.download(f"{server}/blob.bin", str(target), stream=True)
+    assert target.read_bytes() == b"existing"
+
+    library.download(f"{server}/blob.bin", str(target), overwrite=True, stream=True)
+    assert target.read_bytes() == CONTENT
@@ -1,6 +1,20 @@
+import os
 import pytest
+from PIL import Image
 from pathlib import Path
-from RPA.Images import Images, TemplateMatcher, Region, HAS_OPENCV
+
+import RPA.Images
+from RPA.Images import (
+    CaptureStream,
+    Images,
+    ImageNotFoundError,
+    RGB,
+    TemplateMatcher,
+    Region,
+    HAS_OPENCV,
+    find_peaks,
+    to_template,
+)
 
 IMAGES = Path(__file__).resolve().parent / ".." / "resources" / "images"
 
@@ -79,6 +93,290 @@ def test_find_template(region_and_template):
     assert match.center == region.center
 
 
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_template_pyramid(region_and_template):
+    _, template = region_and_template
+
+    library = Images()
+    direct = library.find_template_in_image(IMAGES / "source.png", IMAGES / template)
+    pyramid = library.find_template_in_image(
+        IMAGES / "source.png", IMAGES / template, pyramid=True
+    )
+
+    assert pyramid == direct
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_template_pyramid_fallback():
+    # Coarse levels of this area lead to wrong candidates
+    image = Image.open(IMAGES / "source.png").convert("RGB")
+    template = image.crop((166, 769, 252, 839))
+
+    library = Images()
+    direct = library.find_template_in_image(image, template, limit=1)
+    pyramid = library.find_template_in_image(image, template, limit=1, pyramid=True)
+
+    assert pyramid == direct
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_template_channel_order():
+    def swap_channels(image):
+        return Image.merge("RGB", image.convert("RGB").split()[::-1])
+
+    image = Image.open(IMAGES / "source.png").convert("RGB")
+    template = Image.open(IMAGES / "locator_Calculator_ctrl_Five.jpg")
+
+    matcher = TemplateMatcher(opencv=True)
+    matches_rgb = matcher.match(image, template.convert("RGB"), grayscale=False)
+    matches_bgr = matcher.match(
+        swap_channels(image), swap_channels(template), grayscale=False
+    )
+
+    assert matches_rgb
+    assert matches_rgb == matches_bgr
+
+
+def peak_coefficients():
+    import numpy
+
+    # Second peak overlaps the first one
+    coefficients = numpy.zeros((50, 50), dtype=numpy.float32)
+    for (y, x), score in zip([(10, 10), (11, 12), (40, 40), (0, 0)], [9, 8, 7, 6]):
+        coefficients[y, x] = score / 10
+    return coefficients
+
+
+def as_peaks(ys, xs):
+    return list(zip(ys.tolist(), xs.tolist()))
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires numpy")
+def test_find_peaks():
+    coefficients = peak_coefficients()
+
+    peaks = find_peaks(coefficients, 0.5, 5, 5)
+    assert as_peaks(*peaks) == [(10, 10), (40, 40), (0, 0)]
+    peaks = find_peaks(coefficients, 0.5, 5, 5, limit=2)
+    assert as_peaks(*peaks) == [(10, 10), (40, 40)]
+    peaks = find_peaks(coefficients, 0.5, 1, 1)
+    assert as_peaks(*peaks) == [(10, 10), (11, 12), (40, 40), (0, 0)]
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires numpy")
+def test_find_peaks_compiled(monkeypatch):
+    pytest.importorskip("numba")
+    monkeypatch.setattr(RPA.Images, "NUMBA_MIN_CANDIDATES", 0)
+    coefficients = peak_coefficients()
+
+    peaks = find_peaks(coefficients, 0.5, 5, 5)
+    assert as_peaks(*peaks) == [(10, 10), (40, 40), (0, 0)]
+    peaks = find_peaks(coefficients, 0.5, 5, 5, limit=2)
+    assert as_peaks(*peaks) == [(10, 10), (40, 40)]
+
+
+def screenshot_array():
+    import numpy
+
+    return numpy.asarray(Image.open(IMAGES / "source.png").convert("RGB"))
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_template_in_array():
+    library = Images()
+    region, template = TEMPLATES[0]
+
+    matches = library.find_template_in_image(
+        screenshot_array(), IMAGES / template, region=(0, 900, 400, 1200), limit=1
+    )
+
+    assert len(matches) == 1
+    assert matches[0].center == Region(*region).center
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_templates_on_screen(monkeypatch):
+    library = Images()
+    monkeypatch.setattr(library, "_take_search_screenshot", screenshot_array)
+
+    templates = [IMAGES / template for _, template in TEMPLATES[:5]]
+    results = library.find_templates_on_screen(templates, limit=1)
+
+    assert len(results) == len(templates)
+    for (region, _), matches in zip(TEMPLATES, results):
+        assert len(matches) == 1
+        assert matches[0].center == Region(*region).center
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_templates_on_screen_converts_once(monkeypatch):
+    library = Images()
+    screenshot = screenshot_array()
+    monkeypatch.setattr(library, "_take_search_screenshot", lambda: screenshot)
+
+    converted = []
+    to_grayscale = RPA.Images.to_grayscale
+
+    def convert(array):
+        if array.shape == screenshot.shape:
+            converted.append(array)
+        return to_grayscale(array)
+
+    monkeypatch.setattr(RPA.Images, "to_grayscale", convert)
+
+    templates = [IMAGES / template for _, template in TEMPLATES[:5]]
+    results = library.find_templates_on_screen(templates, limit=1)
+
+    assert len(converted) == 1
+    for (region, _), matches in zip(TEMPLATES, results):
+        assert matches[0].center == Region(*region).center
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_find_templates_on_screen_not_found(monkeypatch):
+    library = Images()
+    monkeypatch.setattr(library, "_take_search_screenshot", screenshot_array)
+    template = Image.new("RGB", (40, 40), "magenta")
+    template.paste(Image.new("RGB", (20, 20), "cyan"), (10, 10))
+
+    assert library.find_templates_on_screen([template]) == [[]]
+
+
+@pytest.mark.skipif(not HAS_OPENCV, reason="Test requires opencv support")
+def test_search_screenshot_reuses_buffer(monkeypatch):
+    import numpy
+
+    library = Images()
+    rgb = screenshot_array()
+    bgra = numpy.dstack((rgb[..., ::-1], numpy.full(rgb.shape[:2], 255, "uint8")))
+    monkeypatch.setattr(library, "_grab", lambda: bgra)
+
+    first = library._take_search_screenshot()
+    second = library._take_search_screenshot()
+
+    assert second is first
+    assert numpy.array_equal(second, rgb)
+
+
+class FakeFrame:
+    size = (2, 1)
+    bgra = bytes([0, 0, 255, 0, 255, 0, 0, 0])
+
+
+class FakeMSS:
+    monitors = [{"left": 0, "top": 0, "width": 2, "height": 1}]
+    error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def grab(self, monitor):
+        if self.error is not None:
+            raise self.error
+        return FakeFrame()
+
+
+def test_capture_stream_latest_frame(monkeypatch):
+    monkeypatch.setattr("mss.mss", FakeMSS)
+    library = Images()
+
+    library.start_capture_stream(fps=100)
+    try:
+        frame = library.get_latest_frame()
+        assert frame.size == (2, 1)
+        assert frame.getpixel((0, 0)) == (255, 0, 0)
+        assert frame.getpixel((1, 0)) == (0, 0, 255)
+    finally:
+        library.stop_capture_stream()
+
+
+def test_capture_stream_error(monkeypatch):
+    monkeypatch.setattr("mss.mss", FakeMSS)
+    monkeypatch.setattr(FakeMSS, "error", OSError("No display"))
+    library = Images()
+
+    library.start_capture_stream()
+    try:
+        with pytest.raises(OSError, match="No display"):
+            library.get_latest_frame()
+    finally:
+        library.stop_capture_stream()
+
+
+def test_capture_stream_stop(monkeypatch):
+    monkeypatch.setattr("mss.mss", FakeMSS)
+    library = Images()
+    library.start_capture_stream(fps=100)
+    stream = library._stream
+
+    library.stop_capture_stream()
+
+    assert not stream.is_alive
+    with pytest.raises(RuntimeError):
+        library.get_latest_frame()
+
+
+def test_capture_stream_context(monkeypatch):
+    monkeypatch.setattr("mss.mss", FakeMSS)
+
+    with CaptureStream(fps=100) as stream:
+        assert stream.latest().size == (2, 1)
+
+    assert not stream.is_alive
+
+
+def test_crop_image_returns_cropped(tmp_path):
+    library = Images()
+    filename = tmp_path / "cropped.png"
+
+    cropped = library.crop_image(IMAGES / "source.png", (10, 20, 110, 70), filename)
+
+    assert cropped.size == (100, 50)
+    with Image.open(filename) as saved:
+        assert saved.size == (100, 50)
+
+
+def test_rgb_luminance():
+    assert RGB(0, 0, 0).luminance() == 0
+    assert RGB(255, 255, 255).luminance() == 255
+    assert RGB(255, 0, 0).luminance() == 76
+    assert RGB.from_pixel(128).luminance() == 128
+
+
+def test_template_cached_until_modified(tmp_path):
+    path = tmp_path / "template.png"
+    path.write_bytes((IMAGES / "source.png").read_bytes())
+
+    template = to_template(path)
+    assert to_template(str(path)) is template
+
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert to_template(path) is not template
+
+
+def test_wait_template_on_screen_retries_until_found(monkeypatch):
+    library = Images()
+    results = [ImageNotFoundError, ImageNotFoundError, [Region(0, 0, 10, 10)]]
+
+    def find_template_on_screen(template, **kwargs):
+        result = results.pop(0)
+        if result is ImageNotFoundError:
+            raise result()
+        return result
+
+    monkeypatch.setattr(library, "find_template_on_screen", find_template_on_screen)
+    monkeypatch.setattr("RPA.Images.to_template", lambda template: template)
+
+    assert library.wait_template_on_screen("template", timeout=5) == [
+        Region(0, 0, 10, 10)
+    ]
+    assert not results
+
+
 @pytest.mark.skip(
     reason="this currently fails because the found template has some offset, at least on multi-monitor setups"
 )
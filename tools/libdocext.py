@@ -4,12 +4,15 @@ Robot Framework Libdoc Extended Edition
 """
 import abc
 import argparse
+import copy
+import functools
 import json
 import logging
 import os
 import re
 import sys
-import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from contextlib import contextmanager
 from pathlib import Path
 
@@ -17,12 +20,45 @@ from robot.errors import DataError
 from robot.libdocpkg import LibraryDocumentation, htmlwriter
 from robot.utils import normalize, unic
 
-BLACKLIST = ("__pycache__",)
-INIT_FILES = ("__init__.robot", "__init__.txt")
-EXTENSIONS = (".robot", ".resource", ".txt")
+BLACKLIST = frozenset(("__pycache__",))
+INIT_FILES = frozenset(("__init__.robot", "__init__.txt"))
+EXTENSIONS = (".robot", ".resource", ".txt")  # Tuple for str.endswith()
+PARALLEL_MIN_PATHS = 4  # Convert fewer libraries than this without a process pool
+RE_SECTION = re.compile(
+    r"\*+\s*(?:(?P<tasks>Test Cases?|Tasks?)|(?:User )?Keywords?)", re.IGNORECASE
+)
 CONVERTERS = {}  # Populated dynamically
 
 
+def get_libdoc(path, doc_format=None):
+    """Build library documentation for the given path. The parsed result is
+    cached until the source is modified, and every caller gets its own copy
+    which can be modified freely.
+    """
+    path = str(path)
+    libdoc = copy.deepcopy(_build_libdoc(path, os.stat(path).st_mtime_ns))
+    if doc_format:
+        libdoc.doc_format = doc_format
+    return libdoc
+
+
+@functools.lru_cache(maxsize=None)
+def _build_libdoc(path, mtime):  # pylint: disable=unused-argument
+    # Docstring format does not affect parsing, it's only stored in the result
+    return LibraryDocumentation(path)
+
+
+def write_json(data, output, pretty=False):
+    if pretty:
+        content = json.dumps(data, indent=4)
+    else:
+        content = json.dumps(data, separators=(",", ":"))
+
+    # Serialize in memory first, as json.dump() writes each token separately
+    with open(output, "w") as fd:
+        fd.write(content)
+
+
 class ConverterMeta(abc.ABCMeta):
     def __new__(cls, name, bases, namespace, **kwargs):
         converter = super().__new__(cls, name, bases, namespace, **kwargs)
@@ -44,6 +80,9 @@ class BaseConverter(metaclass=ConverterMeta):
     NAME = None
     EXTENSION = None
 
+    def __init__(self, config=None):
+        self.config = config or {}
+
     @abc.abstractmethod
     def convert(self, libdoc, output):
         raise NotImplementedError
@@ -59,8 +98,7 @@ class JsonConverter(BaseConverter):
 
     def convert(self, libdoc, output):
         data = htmlwriter.JsonConverter(self._NullFormatter()).convert(libdoc)
-        with open(output, "w") as fd:
-            json.dump(data, fd, indent=4)
+        write_json(data, output, pretty=self.config.get("pretty", False))
 
 
 class JsonHtmlConverter(BaseConverter):
@@ -72,8 +110,7 @@ class JsonHtmlConverter(BaseConverter):
             libdoc.keywords, libdoc.doc, libdoc.doc_format
         )
         data = htmlwriter.JsonConverter(formatter).convert(libdoc)
-        with open(output, "w") as fd:
-            json.dump(data, fd, indent=4)
+        write_json(data, output, pretty=self.config.get("pretty", False))
 
 
 class XmlConverter(BaseConverter):
@@ -106,7 +143,8 @@ class RestConverter(BaseConverter):
 
     IGNORE = (r"^:param.*", r"^:return.*")
 
-    def __init__(self):
+    def __init__(self, config=None):
+        super().__init__(config)
         self.ignore_block = False
 
     def convert(self, libdoc, output):
@@ -262,6 +300,15 @@ class LibdocExt:
         self.logger = logging.getLogger(__name__)
         self.config = config or {}
 
+        # Read options once instead of for every converted file
+        self._ignore = set(self.config.get("ignore", []))
+        self._override_docstring = self.config.get("override_docstring", {})
+        self._override_format = self.config.get("override_format", {})
+        self._collapse = bool(self.config.get("collapse", False))
+        self._title = self.config.get("title")
+        self._namespace = self.config.get("namespace")
+        self._rpa = bool(self.config.get("rpa", False))
+
     def convert_all(self, dir_in, dir_out, format_in, format_out):
         self.logger.info(
             "Searching for libraries in '%s'", ", ".join(str(d) for d in dir_in)
@@ -270,70 +317,125 @@ class LibdocExt:
         assert paths, "No keyword files found"
 
         errors = set()
-        root = os.path.dirname(os.path.commonprefix(paths))
-        for path_in in paths:
-            try:
-                self.convert_path(
-                    path_in=path_in,
-                    dir_out=dir_out,
-                    format_in=format_in,
-                    format_out=format_out,
-                    root=root,
-                )
-            except Exception as err:
-                if self.logger.isEnabledFor(logging.DEBUG):
-                    traceback.print_exc()
-                self.logger.error(str(err).split("\n")[0])
-                errors.add(path_in)
+        # Relative and absolute paths can't be compared with each other,
+        # and the same file might have been found as both
+        if len({path.is_absolute() for path in paths}) > 1:
+            paths = list({path.absolute() for path in paths})
+
+        # Libraries are placed relative to the deepest directory containing
+        # all of them. Parents are compared as module libraries are directories
+        root = Path(os.path.commonpath([os.fspath(path.parent) for path in paths]))
+        options = dict(
+            dir_out=dir_out, format_in=format_in, format_out=format_out, root=root
+        )
+
+        # Libraries are converted in separate processes, as parsing them
+        # is CPU-bound, unless there are too few to be worth the overhead
+        if len(paths) < PARALLEL_MIN_PATHS:
+            for path_in in paths:
+                try:
+                    self.convert_path(path_in=path_in, **options)
+                except Exception as err:
+                    self._log_error(err)
+                    errors.add(path_in)
+        else:
+            with ProcessPoolExecutor(**self._pool_options(len(paths))) as executor:
+                futures = {}
+                for path_in in paths:
+                    future = executor.submit(self.convert_path, path_in, **options)
+                    futures[future] = path_in
+
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as err:
+                        self._log_error(err)
+                        errors.add(futures[future])
 
         return list(errors)
 
+    def _pool_options(self, count):
+        options = {"max_workers": min(count, os.cpu_count() or 1)}
+        # Workers which are not forked don't inherit the logging configuration,
+        # so it's set up again when they start. Python 3.6 has no initializer
+        if sys.version_info >= (3, 7):
+            options["initializer"] = configure_logging
+            options["initargs"] = (self.logger.getEffectiveLevel(),)
+        return options
+
+    def _log_error(self, err):
+        self.logger.debug("Conversion failed", exc_info=True)
+        self.logger.error(str(err).partition("\n")[0])
+
     def find_keyword_files(self, root):
-        paths, stack = set(), [Path(r) for r in root]
+        # Queue paths with their type, so that entries found with
+        # scandir() don't need another stat() call
+        paths = set()
+        queue = deque((Path(r), Path(r).is_dir()) for r in root)
 
-        while stack:
-            path = stack.pop(0)
+        while queue:
+            path, is_dir = queue.popleft()
             if self.should_ignore(path):
                 self.logger.debug("Ignoring file: %s", path)
                 continue
 
-            if path.is_dir():
+            if is_dir:
                 if self.is_module_library(path):
                     paths.add(path)
                     # Check for RF resources files in module
                     paths |= {
                         file
-                        for file in path.glob("**/*")
-                        if self.is_resource_file(path)
+                        for file in self.iter_files(path, EXTENSIONS)
+                        if self.is_resource_file(file)
                     }
                 else:
-                    for child in path.iterdir():
-                        stack.append(child)
+                    with os.scandir(path) as entries:
+                        queue.extend(
+                            (Path(entry.path), entry.is_dir()) for entry in entries
+                        )
             elif self.is_keyword_file(path):
                 paths.add(path)
 
         return list(paths)
 
+    @staticmethod
+    def iter_files(path, suffixes=None):
+        """Recursively yield all files in the given directory,
+        optionally only the ones ending with one of the given suffixes.
+        """
+        stack = [path]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif suffixes is None or entry.name.endswith(suffixes):
+                        if entry.is_file():
+                            yield Path(entry.path)
+
     def should_ignore(self, path):
-        return path in self.config.get("ignore", []) or path.name in BLACKLIST
+        return path in self._ignore or path.name in BLACKLIST
 
     def convert_path(self, path_in, dir_out, format_in, format_out, root=None):
         root = root if root is not None else Path.cwd()
 
+        # Overrides are keyed by resolved path strings
+        path_key = str(path_in.resolve())
+
         # Override default docstring format
-        if path_in in self.config.get("override_docstring", {}):
+        if path_key in self._override_docstring:
             self.logger.debug(f"Overriding docstring format for '{path_in}'")
-            format_in = self.config["override_docstring"][path_in]
+            format_in = self._override_docstring[path_key]
 
         # Override default output format
-        if path_in in self.config.get("override_format", {}):
+        if path_key in self._override_format:
             self.logger.debug(f"Overriding output format for '{path_in}'")
-            format_out = self.config["override_format"][path_in]
+            format_out = self._override_format[path_key]
 
         converter = CONVERTERS[format_out]
 
         path_rel = path_in.with_suffix(converter.EXTENSION).relative_to(root)
-        if self.config.get("collapse", False):
+        if self._collapse:
             path_out = Path(dir_out) / Path(
                 "_".join(part.lower() for part in path_rel.parts)
             )
@@ -343,25 +445,25 @@ class LibdocExt:
         path_out.parent.mkdir(parents=True, exist_ok=True)
 
         self.logger.debug("Converting '%s' to '%s'", path_in, path_out)
-        libdoc = LibraryDocumentation(str(path_in), doc_format=format_in.upper())
+        libdoc = get_libdoc(path_in, doc_format=format_in.upper())
 
         # Override name with user-given value
-        if self.config.get("title"):
-            libdoc.name = self.config["title"]
+        if self._title:
+            libdoc.name = self._title
         # Create module path for library, e.g. RPA.Excel.Files
         else:
             namespace = []
-            if self.config.get("namespace"):
-                namespace.append(self.config["namespace"])
-            if path_rel.parent != Path("."):
-                namespace.append(str(path_rel.parent).replace(os.sep, "."))
+            if self._namespace:
+                namespace.append(self._namespace)
+            if len(path_rel.parts) > 1:
+                namespace.append(".".join(path_rel.parts[:-1]))
             if namespace:
                 libdoc.name = "{namespace}.{name}".format(
                     namespace=".".join(namespace), name=libdoc.name,
                 )
 
         # Convert library scope to RPA format
-        if self.config.get("rpa", False):
+        if self._rpa:
             scope = normalize(unic(libdoc.scope), ignore="_")
             libdoc.scope = {
                 "testcase": "Task",
@@ -369,13 +471,16 @@ class LibdocExt:
                 "global": "Global",
             }.get(scope, "")
 
-        converter().convert(libdoc, path_out)
+        converter(self.config).convert(libdoc, path_out)
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def is_module_library(path):
-        return (path / "__init__.py").is_file() and bool(
-            LibraryDocumentation(str(path)).keywords
-        )
+        if not (path / "__init__.py").is_file():
+            return False
+        # Only reads the cached result, so it doesn't need a copy
+        libdoc = _build_libdoc(str(path), os.stat(path).st_mtime_ns)
+        return bool(libdoc.keywords)
 
     @staticmethod
     def is_keyword_file(file):
@@ -383,21 +488,32 @@ class LibdocExt:
 
     @staticmethod
     def is_library_file(file):
-        return file.suffix == ".py" and file.name != "__init__.py"
+        name = file.name
+        return name.endswith(".py") and name != "__init__.py"
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def is_resource_file(file):
-        if file.name in INIT_FILES or file.suffix not in EXTENSIONS:
+        name = file.name
+        if name in INIT_FILES or not name.endswith(EXTENSIONS):
             return False
 
-        def contains(data, pattern):
-            return bool(re.search(pattern, data, re.MULTILINE | re.IGNORECASE))
+        # Read section headers line by line, suites with tests or tasks
+        # are not resource files even if they have keywords
+        has_keywords = False
+        with open(file, "rb") as fd:
+            for line in fd:
+                # Headers start with an asterisk, only decode those lines
+                if not line.startswith(b"*"):
+                    continue
+                match = RE_SECTION.match(line.decode("utf-8", errors="ignore"))
+                if not match:
+                    continue
+                if match.group("tasks"):
+                    return False
+                has_keywords = True
 
-        with open(file, "r", encoding="utf-8", errors="ignore") as fd:
-            data = fd.read()
-            has_keywords = contains(data, r"^\*+\s*((?:User )?Keywords?)")
-            has_tasks = contains(data, r"^\*+\s*(Test Cases?|Tasks?)")
-            return not has_tasks and has_keywords
+        return has_keywords
 
 
 class PathOverrideAction(argparse.Action):
@@ -411,12 +527,20 @@ class PathOverrideAction(argparse.Action):
         for value in values:
             try:
                 key, val = value.split("=")
-                args[Path(key)] = val
+                args[str(Path(key).resolve())] = val
             except Exception as exc:
                 raise argparse.ArgumentError(self, exc)
         setattr(namespace, self.dest, args)
 
 
+def configure_logging(level):
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=level,
+        format="%(asctime)s %(levelname)-8s %(message)s",
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -473,18 +597,16 @@ def main():
         action="store_true",
     )
     parser.add_argument("-t", "--title", help="Override title for generated files")
+    parser.add_argument(
+        "--pretty", help="Indent generated JSON files", action="store_true"
+    )
     parser.add_argument("--rpa", help="Use tasks instead of tests", action="store_true")
     parser.add_argument(
         "-v", "--verbose", help="Be more talkative", action="store_true"
     )
     args = parser.parse_args()
 
-    log_level = logging.DEBUG if args.verbose else logging.INFO
-    logging.basicConfig(
-        stream=sys.stdout,
-        level=log_level,
-        format="%(asctime)s %(levelname)-8s %(message)s",
-    )
+    configure_logging(logging.DEBUG if args.verbose else logging.INFO)
 
     app = LibdocExt(
         config={
@@ -495,6 +617,7 @@ def main():
             "override_format": args.override_format,
             "namespace": args.namespace,
             "collapse": args.collapse,
+            "pretty": args.pretty,
         }
     )
 